@@ -3,7 +3,7 @@
 Script extracting timesheets for the user.
 
 source venv/bin/activate
-pip3 install requests
+pip3 install requests lxml    # lxml is optional, but parses faster
 
 export VERTEC_URL=
 export VERTEC_USERNAME=
@@ -13,18 +13,50 @@ python3 vertec-timesheets.py
 """
 
 import os
+import sys
 import json
+import time
 import logging
 import configparser
 from getpass import getpass
 from xml.sax.saxutils import escape as xmlescape
-import xml.etree.ElementTree as ET
-from datetime import datetime, timedelta
+from datetime import date
 from itertools import groupby
+from operator import itemgetter
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from xml.parsers import expat
+try:
+    # libxml2 is the fastest parser to feed the responses to
+    from lxml import etree as ET
+except ImportError:
+    ET = None
 
 logging.basicConfig(level=logging.WARN)
 
+# Shared HTTP session: keeps the TLS connection to the Vertec server alive across the
+# auth call, the users query and every per-user timesheet query.
+# Transient errors are retried with exponential backoff on the pooled connection; once the
+# retries are exhausted the last response is returned and reported as usual.
+HTTP_POOL_MAXSIZE = 16
+# Number of queries run concurrently: each holds a pooled connection, so it stays within the pool size
+QUERY_WORKERS = min(8, HTTP_POOL_MAXSIZE)
+# (connect, read) timeouts: a connection that cannot be established fails fast and is retried,
+# while the query responses, which the server may take a while to compute, get their own read timeout
+HTTP_CONNECT_TIMEOUT = 3.05
+QUERY_TIMEOUT = (HTTP_CONNECT_TIMEOUT, 30)
+AUTH_TIMEOUT = (HTTP_CONNECT_TIMEOUT, 5)
+SESSION = requests.Session()
+http_retry = Retry(total=5, connect=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504),
+                   allowed_methods=frozenset(["POST"]), raise_on_status=False)
+http_adapter = HTTPAdapter(max_retries=http_retry, pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE)
+SESSION.mount("https://", http_adapter)
+SESSION.mount("http://", http_adapter)
+SESSION.headers.update({'Content-Type': 'text/plain; charset=utf-8', 'Connection': 'keep-alive'})
+
 # Determine INI file path and load if exists
 config = configparser.ConfigParser()
 config_file = os.environ.get('VERTEC_INI', 'vertec.ini')
@@ -35,6 +67,19 @@ if config_exists:
 else:
     logging.debug(f"INI file {config_file} not found; will prompt for values and save them")
 
+# Cache files live in a directory of their own, only accessible by the current user
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'vertec')
+
+# Auth tokens are cached on disk so that repeated runs can skip the auth round-trip.
+# A cached token is reused for TOKEN_TTL seconds, minus a safety margin.
+TOKEN_CACHE_FILE = os.path.expanduser(os.environ.get('VERTEC_TOKEN_CACHE') or os.path.join(CACHE_DIR, 'token.json'))
+TOKEN_TTL = 60 * 60
+TOKEN_SAFETY_MARGIN = 60
+
+# The users of the team change rarely, so they are cached as well, for USERS_CACHE_TTL seconds.
+USERS_CACHE_FILE = os.path.expanduser(os.environ.get('VERTEC_USERS_CACHE') or os.path.join(CACHE_DIR, 'users.json'))
+USERS_CACHE_TTL = 24 * 60 * 60
+
 # Vertec query to retrieve information about the currently logged-in user
 QUERY_MY_USERS = """<Query>
     <Selection>
@@ -53,120 +98,272 @@ QUERY_MY_USERS = """<Query>
     </Resultdef>
 </Query>"""
 
+# Fields of the timesheet rows, shared by the per-user and the team timesheet queries
+TS_RESULTDEF = """    <Resultdef>
+        <!-- Details on fields: https://www.vertec.com/ch/kb/leistunginocl/
+             Only the fields the report needs are retrieved: every further one would be
+             transferred, parsed and stored in each row for nothing. -->
+        <member>datum</member>
+        <member>minutenint</member>
+        <member>bearbeiter</member>
+        <expression><alias>projekt_name</alias><ocl>projekt</ocl></expression>
+        <expression><alias>phase_name</alias><ocl>phase.code</ocl></expression>
+    </Resultdef>"""
+
 # Vertec query to retrieve information about the timesheets (leistungen) for the specified object (user, project, phase)
-#    The object reference MUST be added as {param} parameter.
-QUERY_TS = """<Query>
+#    The object reference MUST be added as {param} parameter (doubled braces in the f-string).
+QUERY_TS = f"""<Query>
     <Selection>
         <!-- parameter is here the ID of a phase or user -->
-        <objref>{param}</objref>
+        <objref>{{param}}</objref>
         <!-- All open and closed services for the selected project or phase-->
         <ocl>offeneleistungen->select((datum &gt;= date->firstOfMonth->incMonth(-1)) and (datum &lt; date->firstOfMonth))->orderby(datum)->union(verrechneteleistungen->select((datum &gt;= date->firstOfMonth->incMonth(-1)) and (datum &lt; date->firstOfMonth))->orderby(datum))</ocl>
         <sqlorder>datum</sqlorder>
     </Selection>
-    <Resultdef>
-        <!-- Details on fields: https://www.vertec.com/ch/kb/leistunginocl/ -->
-        <member>datum</member>
-        <member>minutenint</member>
-        <member>wertint</member>
-        <member>wertext</member>
-        <member>text</member>
-        <member>phase</member>
-        <member>projekt</member>
-        <member>bearbeiter</member>
-        <expression><alias>bearbeiter_name</alias><ocl>bearbeiter.name</ocl></expression>
-        <expression><alias>projekt_name</alias><ocl>projekt</ocl></expression>
-        <expression><alias>phase_name</alias><ocl>phase.code</ocl></expression>
-        <expression><alias>phase_is_billable</alias><ocl>phase.verrechenbar</ocl></expression>
-    </Resultdef>
+{TS_RESULTDEF}
 </Query>"""
+# QUERY_TS split at its {param} placeholder once, as ready-to-send bytes, so that a query
+# only needs two concatenations
+QUERY_TS_PRE, QUERY_TS_POST = (part.encode('utf-8') for part in QUERY_TS.split("{param}"))
 
-def get_vertec_data(endpoint: str, token:str, query:str):
-    """Queries the Vertec XML API and 'yields' the returned data to the caller as an iterator."""
-    try:
-        envelope = f"""<Envelope><Header><BasicAuth><Token>{token}</Token></BasicAuth></Header><Body>{query}</Body></Envelope>"""
-        r = requests.request("POST", f"{endpoint}/xml", headers={'Content-Type': 'text/plain'}, data=envelope, timeout=30)
-        r.raise_for_status()
-        body_elem = ET.fromstring(r.text).find("Body")
-        fault_elem = body_elem.find("Fault")
-        if fault_elem:
-            """
-            <Fault>
-                <faultcode>Client</faultcode>
+# Vertec query to retrieve the timesheets (leistungen) of all active users whose team leader is the currently logged-in user,
+#    in a single round-trip. Every row carries its 'bearbeiter' reference, so that it can be assigned to its user.
+QUERY_TEAM_TS = f"""<Query>
+    <Selection>
+        <!-- All open and closed services of the active team members of the currently logged in user -->
+        <ocl>projektbearbeiter->select(aktiv and (teamleiter.asstring=Timsession.allInstances->first.login.name)).offeneleistungen->select((datum &gt;= date->firstOfMonth->incMonth(-1)) and (datum &lt; date->firstOfMonth))->union(projektbearbeiter->select(aktiv and (teamleiter.asstring=Timsession.allInstances->first.login.name)).verrechneteleistungen->select((datum &gt;= date->firstOfMonth->incMonth(-1)) and (datum &lt; date->firstOfMonth)))</ocl>
+        <sqlorder>datum</sqlorder>
+    </Selection>
+{TS_RESULTDEF}
+</Query>"""
+
+# Envelope of the API requests, split around the auth token and the query, as ready-to-send bytes
+ENVELOPE_PRE = b"<Envelope><Header><BasicAuth><Token>"
+ENVELOPE_MID = b"</Token></BasicAuth></Header><Body>"
+ENVELOPE_POST = b"</Body></Envelope>"
+
+
+class ExpatParser:
+    """Push parser driving a parser target straight from expat, used when lxml is not installed.
+
+    It offers the feed()/close() interface of lxml's XMLParser. Consecutive character data is
+    buffered by expat, so that the target gets one data() call per text instead of one per chunk.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.parser = expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = target.start
+        self.parser.EndElementHandler = target.end
+        self.parser.CharacterDataHandler = target.data
+
+    def feed(self, data:bytes):
+        self.parser.Parse(data, False)
+
+    def close(self):
+        self.parser.Parse(b"", True)
+        return self.target.close()
+
+
+class VertecAuthError(Exception):
+    """Raised when the Vertec server rejects the authentication token."""
+
+
+class VertecTarget:
+    """Parser target turning a Vertec XML response into dicts, without building any elements.
+
+    The parser calls start()/data()/end() for every element; the position in the document is
+    tracked by its depth alone. Nothing depends on the Resultdef of the query: every field of
+    a record ends up in its dict under its tag, so the same target serves all queries.
+    Completed records are collected in .records, from where they may be taken while parsing;
+    close() returns the remaining ones, or the fault as the only entry.
+
+        <Envelope>                                      depth 1
+        <Body>                                          depth 2
+            <QueryResponse>                             depth 3
+            <ProjektPhase>                              depth 4: a record
+                <objid>2699811</objid>                  depth 5: a field of the record
+                <aktiv>0</aktiv>
+                <planWertExt><accessdenied/></planWertExt>
+                <projekt>
+                    <objref>2671828</objref>            depth 6: the value of a reference field
+                </projekt>
+
+    or, if the query could not be executed:
+
+        <Envelope>
+        <Body>
+            <Fault>                                     depth 3
+                <faultcode>Client</faultcode>           depth 4
                 <faultstring>Error(s) in XML input</faultstring>
                 <details>
                     <detailitem>Error: 84:Parenthesis are not in balance on line 10 col 22</detailitem>
                     <detailitem>Error: 0:This variable () has no value or type on line 19 col 43</detailitem>
-                    <detailitem>Error: expression Element without ocl on line 20 col 25</detailitem>
-                    <detailitem>Error: 0:This variable () has no value or type on line 23 col 44</detailitem>
-                    <detailitem>Error: expression Element without ocl on line 24 col 25</detailitem>
                 </details>
             </Fault>
-            """
-            d = {
-                'fault_code': fault_elem.find("faultcode").text,
-                'fault_string': fault_elem.find("faultstring").text,
-                'details' : [],
-                'query_executed': query
-            }
-            for det_item in fault_elem.find("details"):
-                d['details'].append(det_item.text)
-
-            yield d
-            return
+    """
+
+    # keys of the fault dict, by the tag of the <Fault> child they are taken from
+    FAULT_KEYS = {'faultcode': 'fault_code', 'faultstring': 'fault_string'}
+
+    def __init__(self, query):
+        self.query = query
+        self.depth = 0
+        self.in_body = False
+        self.is_fault = None
+        self.fault = None
+        self.unexpected_tag = None
+        self.records = []
+        self.record = None
+        self.text = []
+        self.field_children = 0
+        self.field_value = None
+
+    def start(self, tag, attrib):
+        self.depth += 1
+        self.text.clear()
+        if self.depth == 2:
+            self.in_body = tag == "Body"
+        elif self.depth == 3 and self.in_body and self.is_fault is None:
+            # the first child of <Body> tells whether the query failed or not
+            if tag not in ("Fault", "QueryResponse"):
+                # kept for close(), which lxml calls itself after a callback raised
+                self.unexpected_tag = tag
+                raise Exception(f"unexpected <{tag}> element in the response body")
+            self.is_fault = tag == "Fault"
+            if self.is_fault:
+                self.fault = {
+                    'fault_code': None,
+                    'fault_string': None,
+                    'details' : [],
+                    'query_executed': self.query.decode('utf-8') if isinstance(self.query, bytes) else self.query
+                }
+        elif self.is_fault is False:
+            if self.depth == 4:
+                self.record = {'datatype': tag}
+            elif self.depth == 5:
+                self.field_children = 0
+                self.field_value = None
+            elif self.depth == 6:
+                self.field_children += 1
 
-        for result in body_elem.find("QueryResponse"):
-            """
-            <Envelope>
-            <Body>
-                <QueryResponse>
-                <ProjektPhase>
-                    <objid>2699811</objid>
-                    <aktiv>0</aktiv>
-                    <planWertExt><accessdenied/></planWertExt>
-                    <projekt>
-                        <objref>2671828</objref>
-                    </projekt>
-            """
-            #if len(list(e.iter("accessdenied"))) > 0:
-            #    # user cannot access some fields of this data. what to do?!
-            #    pass
-            d = {}
-            d['datatype'] = result.tag
-            for field in result:
-                field_elements = list(field.iter())
-                if len(field_elements)==1:
-                    # the iter() function returns the element itself as first result
-                    # so if the list has length=1, the element does not have any children
-                    d[field.tag] = field.text.strip() if field.text else None
-                elif field_elements[-1].tag == "accessdenied":
-                    d[field.tag] = "accessdenied"
-                else:
-                    d[field.tag] = field_elements[-1].text.strip() if field_elements[-1].text else None
+    def data(self, data):
+        self.text.append(data)
+
+    def end(self, tag):
+        depth = self.depth
+        self.depth -= 1
+        if self.is_fault:
+            if depth == 4 and tag in self.FAULT_KEYS:
+                self.fault[self.FAULT_KEYS[tag]] = "".join(self.text)
+            elif depth == 5 and tag == "detailitem":
+                self.fault['details'].append("".join(self.text))
+            return
+        if self.is_fault is None or self.record is None:
+            return
 
+        if depth == 6:
+            # the value of a field is given by its first child, which is either
+            # a reference to another object, e.g. <projekt><objref>2671828</objref></projekt>,
+            # or a marker that the value cannot be accessed, e.g. <planWertExt><accessdenied/></planWertExt>
+            if self.field_children == 1:
+                self.field_value = "accessdenied" if tag == "accessdenied" else self.value()
+        elif depth == 5:
+            if self.field_children:
+                self.record[tag] = self.field_value
+            else:
+                # plain value, e.g. <aktiv>0</aktiv>
+                self.record[tag] = self.value()
+        elif depth == 4:
             # the vertec API returns records also for objects which might not be accessible
             # and will set an "<accessdenied>" element as value of the return values.
             # I want to IGNORE such records and not yield them to the caller
             # In order to do this, I check for the field 'aktiv', which is generally related to projects and phases,
             # and ignore records where such field has an "accessdenied" value
+            if self.record.get('aktiv', "whatever") != "accessdenied":
+                self.records.append(self.record)
+            self.record = None
+
+    def value(self):
+        """Returns the text of the element just ended, stripped, or None if it has none.
+
+        Parsers usually deliver a text in one piece, which join() and strip() hand back as is.
+        """
+        text = "".join(self.text)
+        return text.strip() if text else None
+
+    def close(self):
+        if self.unexpected_tag is not None:
+            raise Exception(f"unexpected <{self.unexpected_tag}> element in the response body")
+        if self.is_fault is None:
+            raise Exception("the response body contains neither a <Fault> nor a <QueryResponse>")
+        return [self.fault] if self.is_fault else self.records
+
+
+def post_query(endpoint: str, token:str, query, session: requests.Session = SESSION) -> requests.Response:
+    """Posts a query, given as str or as UTF-8 encoded bytes, to the Vertec XML API and returns the response,
+    with its body still to be read.
+    """
+    if isinstance(query, str):
+        query = query.encode('utf-8')
+    envelope = b"".join((ENVELOPE_PRE, xmlescape(token).encode('utf-8'), ENVELOPE_MID, query, ENVELOPE_POST))
+    # The OCL query envelope is served by the XML interface only; probing for a JSON
+    # flavour would cost an additional round-trip on every run, so the XML is parsed as it is.
+    r = session.post(f"{endpoint}/xml", data=envelope, timeout=QUERY_TIMEOUT, stream=True)
+    if r.status_code == 401:
+        r.close()
+        raise VertecAuthError(f"post_query: the auth token was rejected by {endpoint}")
+    try:
+        r.raise_for_status()
+    except requests.HTTPError:
+        r.close()
+        raise
+    return r
+
+
+def parse_response(r: requests.Response, query):
+    """Parses the body of a response as it arrives and yields its records, or its fault."""
+    # The parser hands every element straight to the target, which builds the records
+    # from it: no element tree is ever built for the response. The body is fed to the
+    # parser as it arrives, and the records completed so far are handed out right away.
+    target = VertecTarget(query)
+    parser = ET.XMLParser(target=target) if ET is not None else ExpatParser(target)
+    for chunk in r.iter_content(chunk_size=65536):
+        parser.feed(chunk)
+        if target.records:
+            records, target.records = target.records, []
+            yield from records
+    yield from parser.close()
 
-            if d.get('aktiv', "whatever") != "accessdenied":
-                yield d
+
+def get_vertec_data(endpoint: str, token:str, query, session: requests.Session = SESSION):
+    """Queries the Vertec XML API and 'yields' the returned data to the caller as an iterator.
+    The query is given as str or as UTF-8 encoded bytes.
+    """
+    try:
+        with post_query(endpoint, token, query, session) as r:
+            yield from parse_response(r, query)
+    except VertecAuthError:
+        raise
     except requests.HTTPError as e:
         raise Exception(f"get_vertec_data: http error while retrieving vertec data. {e}")
     except Exception as e:
         raise Exception(f"get_vertec_data: exception when retrieving vertec data {type(e)} - {str(e)}")
 
 
-def get_vertec_token(endpoint: str, username:str, password:str) -> str:
+def get_vertec_token(endpoint: str, username:str, password:str, session: requests.Session = SESSION) -> str:
     """Connects to vertec and returns an authentication token to be used for subsequent API calls
     """
     try:
-        r = requests.post(f"{endpoint}/auth/xml",
+        r = session.post(f"{endpoint}/auth/xml",
                 headers={'Content-Type': 'application/x-www-form-urlencoded'},
                 data=dict(vertec_username=username, password=password),
-                timeout=5)
+                timeout=AUTH_TIMEOUT)
         r.raise_for_status()
         logging.debug(f"vertec: retrieved auth token from vertec")
+        # the token is plain ASCII: spare requests guessing the charset of the response
+        r.encoding = 'utf-8'
         return r.text
     except requests.HTTPError as e:
         raise Exception(f"get_vertec_token: error while retrieving vertec auth token for username '{username}' {str(e)}")
@@ -174,6 +371,149 @@ def get_vertec_token(endpoint: str, username:str, password:str) -> str:
         raise Exception(f"get_vertec_token:: fatal error while retrieving vertec auth token: {str(e)}")
 
 
+def read_cache(cache_file: str, endpoint: str, username:str):
+    """Returns the data cached by a previous run for the same endpoint and username, or None."""
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get('endpoint') != endpoint or cached.get('username') != username:
+        return None
+    return cached
+
+
+def write_cache(cache_file: str, endpoint: str, username:str, **data):
+    """Stores data for subsequent runs. The file is only readable by the current user."""
+    try:
+        # a bare file name is kept in the current directory, which needs no creating
+        cache_dir = os.path.dirname(cache_file)
+        if cache_dir:
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        fd = os.open(cache_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(dict(endpoint=endpoint, username=username, **data), f)
+    except OSError as e:
+        logging.warning(f"could not write the cache file {cache_file}: {e}")
+
+
+def invalidate_cache(cache_file: str):
+    """Removes a cache file, e.g. after its content turned out to be outdated."""
+    try:
+        os.remove(cache_file)
+    except FileNotFoundError:
+        pass
+
+
+def load_cached_token(endpoint: str, username:str):
+    """Returns the auth token cached by a previous run, or None if there is no usable one."""
+    cached = read_cache(TOKEN_CACHE_FILE, endpoint, username)
+    if cached is None:
+        return None
+    if cached.get('expires_at', 0) <= time.time() + TOKEN_SAFETY_MARGIN:
+        logging.debug(f"cached auth token in {TOKEN_CACHE_FILE} has expired")
+        return None
+    return cached.get('token')
+
+
+def save_cached_token(endpoint: str, username:str, token:str):
+    """Stores the auth token for subsequent runs."""
+    write_cache(TOKEN_CACHE_FILE, endpoint, username, token=token, expires_at=time.time() + TOKEN_TTL)
+
+
+def load_cached_users(endpoint: str, username:str):
+    """Returns the users of the team cached by a previous run, or None if there are no recent ones."""
+    cached = read_cache(USERS_CACHE_FILE, endpoint, username)
+    if cached is None:
+        return None
+    if cached.get('cached_at', 0) <= time.time() - USERS_CACHE_TTL:
+        logging.debug(f"cached users in {USERS_CACHE_FILE} are outdated")
+        return None
+    return cached.get('users')
+
+
+def save_cached_users(endpoint: str, username:str, users:list):
+    """Stores the users of the team for subsequent runs."""
+    write_cache(USERS_CACHE_FILE, endpoint, username, users=users, cached_at=time.time())
+
+
+def is_fault(rows:list) -> bool:
+    """Tells whether the rows returned by get_vertec_data() are a fault rather than records."""
+    return len(rows) > 0 and 'fault_code' in rows[0]
+
+
+def get_records(endpoint: str, token:str, query) -> list:
+    """Returns the records of a query, given as str or as UTF-8 encoded bytes, as a list;
+    raises if the server could not execute it.
+    """
+    rows = list(get_vertec_data(endpoint, token, query))
+    if is_fault(rows):
+        raise Exception(f"get_records: query failed: {rows[0]['fault_string']} {rows[0]['details']}")
+    return rows
+
+
+def get_batched_timesheets(endpoint: str, token:str):
+    """Retrieves the timesheets of the whole team with a single query, and returns their rows by
+    the objid of the user they belong to; or None if the server could not evaluate the query.
+    """
+    logging.info(f"executing query:\n{QUERY_TEAM_TS}")
+    rows_by_user = defaultdict(list)
+    # the rows are grouped as they stream in; a fault would be the first and only one
+    for row in get_vertec_data(endpoint, token, QUERY_TEAM_TS):
+        if 'fault_code' in row:
+            logging.info(f"batched timesheet query failed ({row['fault_string']})")
+            return None
+        rows_by_user[row['bearbeiter']].append(row)
+    return dict(rows_by_user)
+
+
+def get_user_timesheets(endpoint: str, token:str, users:list) -> dict:
+    """Retrieves the timesheets of the given users with one query each, and returns their rows by
+    the objid of the user they belong to.
+    """
+    def get_user_timesheet(user):
+        logging.info(f"executing timesheet query for user {user['objid']}")
+        query = QUERY_TS_PRE + user['objid'].encode('utf-8') + QUERY_TS_POST
+        return get_records(endpoint, token, query)
+
+    # The per-user queries are independent and I/O bound: run them concurrently over the shared session.
+    with ThreadPoolExecutor(max_workers=QUERY_WORKERS) as executor:
+        return dict(zip([user['objid'] for user in users], executor.map(get_user_timesheet, users)))
+
+
+def get_team_timesheets(endpoint: str, username:str, token:str):
+    """Returns the active users of the team of the logged-in user, and their timesheet rows by user objid.
+
+    The timesheets of the whole team are retrieved with a single query. Should the server not be
+    able to evaluate it, every one of the active users is queried on their own instead.
+    """
+    users = load_cached_users(endpoint, username)
+    users_cached = users is not None
+    if users_cached:
+        logging.info(f"reusing cached users from {USERS_CACHE_FILE}")
+        timesheets = get_batched_timesheets(endpoint, token)
+    else:
+        # The batched timesheet query does not depend on the users: run both queries side by side,
+        # so that they cost a single round-trip.
+        logging.info(f"getting the users of the team of the currently logged in user")
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            users_future = executor.submit(get_records, endpoint, token, QUERY_MY_USERS)
+            timesheets = get_batched_timesheets(endpoint, token)
+            users = users_future.result()
+        save_cached_users(endpoint, username, users)
+
+    if timesheets is None:
+        logging.info(f"querying the timesheets of the users one by one")
+        timesheets = get_user_timesheets(endpoint, token, [user for user in users if user['aktiv'] == '1'])
+    elif users_cached and not timesheets.keys() <= {user['objid'] for user in users if user['aktiv'] == '1'}:
+        # somebody who is missing or inactive in the cached users booked time, so the team has changed since
+        logging.info(f"cached users are outdated; getting the users of the team again")
+        users = get_records(endpoint, token, QUERY_MY_USERS)
+        save_cached_users(endpoint, username, users)
+
+    return [user for user in users if user['aktiv'] == '1'], timesheets
+
+
 if __name__ == "__main__":
     try:
         # Load or prompt config
@@ -196,51 +536,69 @@ if __name__ == "__main__":
                 config.write(f)
             logging.info(f"Saved configuration to {config_file}")
 
-        # authenticate against vertec and cache the token
-        logging.info(f"retrieving auth token from vertec server {url} for {username}")
-        token = get_vertec_token(url, username, password)
-
-        logging.info(f"getting ID of currently logged in user")
-        for user in get_vertec_data(url, token, QUERY_MY_USERS):
-            if (user['aktiv'] == '1'):
-                print("\n\033[92m### %s (%s)\033[0m" % (user['name'], user['objid']))
-                query = QUERY_TS.format(param=user['objid'])
-                logging.info(f"executing query:\n{query}")
-
-                # Get and sort rows by date.
-                rows = list(get_vertec_data(url, token, query))
-                rows.sort(key=lambda r: r['datum'])
-
-                # Initialize expected_date to the first day of the month of the first booking.
-                if rows:
-                    first_date = datetime.strptime(rows[0]['datum'].strip(), "%Y-%m-%d")
-                    expected_date = first_date.replace(day=1)
-                else:
-                    expected_date = None
-
-                # Group rows by their date.
-                for date_str, group in groupby(rows, key=lambda r: r['datum']):
-                    current_date = datetime.strptime(date_str.strip(), "%Y-%m-%d")
-
-                    # Print missing days from expected_date until we reach the current booking date.
-                    # We compare full dates so that even if there are multiple bookings on one day,
-                    # we only advance expected_date once.
-                    while expected_date < current_date:
-                        # Only print missing if it's a weekday (0=Monday, ..., 4=Friday)
-                        if expected_date.weekday() < 5:
-                            print(f"{expected_date.strftime('%Y-%m-%d')} - MISSING")
-                        expected_date += timedelta(days=1)
-
-                    # Optionally print a blank line if current_date is a Monday.
-                    if current_date.weekday() == 0:
-                        print()
-
-                    # Process all rows for the current_date.
-                    for row in group:
-                        print(f"{row['datum']} - {row['projekt_name']:<30} | {row['phase_name']:<40} :: {round(float(row['minutenInt']) / 60, 1)}")
-
-                    # Advance expected_date by one day after processing the current date.
-                    expected_date += timedelta(days=1)
+        # authenticate against vertec, unless a previous run left a valid token in the cache
+        token = load_cached_token(url, username)
+        if token:
+            logging.info(f"reusing cached auth token from {TOKEN_CACHE_FILE}")
+        else:
+            logging.info(f"retrieving auth token from vertec server {url} for {username}")
+            token = get_vertec_token(url, username, password)
+            save_cached_token(url, username, token)
+
+        try:
+            users, timesheets = get_team_timesheets(url, username, token)
+        except VertecAuthError:
+            # the cached token is no longer accepted: authenticate again and retry once
+            logging.info(f"auth token rejected; retrieving a new one from vertec server {url} for {username}")
+            invalidate_cache(TOKEN_CACHE_FILE)
+            token = get_vertec_token(url, username, password)
+            save_cached_token(url, username, token)
+            users, timesheets = get_team_timesheets(url, username, token)
+
+        # The whole report is collected line by line and written out at once: all data is at hand
+        # by now, so nothing is gained by writing it piecemeal.
+        lines = []
+        for user in users:
+            rows = timesheets.get(user['objid'], [])
+
+            lines.append("\n\033[92m### %s (%s)\033[0m" % (user['name'], user['objid']))
+
+            # Sort rows by date, which the grouping below relies on. The server gives no overall order:
+            # the open and the billed services come as separate selections, and the team query does
+            # not order them at all. Runs that are already ordered are merged by the sort in linear time.
+            rows.sort(key=itemgetter('datum'))
+
+            # Group rows by their date. Days are handled as date ordinals: each booking date is
+            # parsed once per group, and days are only formatted back to text when printed.
+            expected_day = None
+            for date_str, group in groupby(rows, key=itemgetter('datum')):
+                current_date = date.fromisoformat(date_str)
+                current_day = current_date.toordinal()
+
+                # Initialize expected_day to the first day of the month of the first booking.
+                if expected_day is None:
+                    expected_day = current_day - current_date.day + 1
+
+                # Print missing days from expected_day until we reach the current booking date.
+                # Ordinal 1 (0001-01-01) is a Monday, so (day - 1) % 7 is the weekday (0=Monday, ..., 6=Sunday)
+                for missing_day in range(expected_day, current_day):
+                    # Only print missing if it's a weekday (0=Monday, ..., 4=Friday)
+                    if (missing_day - 1) % 7 < 5:
+                        lines.append(f"{date.fromordinal(missing_day).isoformat()} - MISSING")
+
+                # Optionally print a blank line if current_date is a Monday.
+                if (current_day - 1) % 7 == 0:
+                    lines.append("")
+
+                # Process all rows for the current_date.
+                for row in group:
+                    lines.append(f"{row['datum']} - {row['projekt_name']:<30} | {row['phase_name']:<40} :: {round(float(row['minutenInt']) / 60, 1)}")
+
+                # Even if there are multiple bookings on one day, the next expected day is the one after.
+                expected_day = current_day + 1
+
+        if lines:
+            sys.stdout.write("\n".join(lines) + "\n")
 
     except Exception as e:
         logging.fatal(str(e))